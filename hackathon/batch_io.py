@@ -0,0 +1,272 @@
+import ctypes
+import ctypes.util
+import errno
+import os
+import socket
+import struct
+import sys
+from typing import List, Optional, Sequence, Tuple
+
+RECV_BATCH_SIZE: int = 64  # Maximum number of datagrams pulled from the kernel per syscall
+SEND_BATCH_SIZE: int = 64  # Maximum number of datagrams handed to the kernel per syscall
+MSG_WAITFORONE: int = 0x10000  # Linux recvmmsg flag: block for the first datagram only, then drain without waiting
+SO_RXQ_OVFL: int = 40  # Linux socket option attaching the socket's receive-queue drop counter to each datagram
+SO_TIMESTAMPNS: int = 35  # Linux socket option attaching the kernel receive time (struct timespec) to each datagram
+_CMSG_HEADER = struct.Struct("@Nii")  # struct cmsghdr: len, level, type
+_DROP_COUNTER = struct.Struct("@I")  # SO_RXQ_OVFL payload, a uint32 counter
+_TIMESPEC = struct.Struct("@ll")  # SO_TIMESTAMPNS payload, seconds and nanoseconds since the epoch
+_CONTROL_SIZE = socket.CMSG_SPACE(_DROP_COUNTER.size) + socket.CMSG_SPACE(_TIMESPEC.size)  # Room for both per datagram
+
+
+class _IOVec(ctypes.Structure):
+    _fields_ = [
+        ("iov_base", ctypes.c_void_p),
+        ("iov_len", ctypes.c_size_t),
+    ]
+
+
+class _MsgHdr(ctypes.Structure):
+    _fields_ = [
+        ("msg_name", ctypes.c_void_p),
+        ("msg_namelen", ctypes.c_uint32),
+        ("msg_iov", ctypes.POINTER(_IOVec)),
+        ("msg_iovlen", ctypes.c_size_t),
+        ("msg_control", ctypes.c_void_p),
+        ("msg_controllen", ctypes.c_size_t),
+        ("msg_flags", ctypes.c_int),
+    ]
+
+
+class _MMsgHdr(ctypes.Structure):
+    _fields_ = [
+        ("msg_hdr", _MsgHdr),
+        ("msg_len", ctypes.c_uint),
+    ]
+
+
+def _load_libc_function(name: str, argtypes: list):
+    """
+    Loads a Linux libc function if the platform provides it.
+
+    :param name: The function's name.
+    :param argtypes: The function's ctypes argument types.
+    :return: The ctypes function, or None if batching is unavailable.
+    """
+    if not sys.platform.startswith("linux"):
+        return None
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        function = getattr(libc, name)
+    except (OSError, AttributeError):
+        return None
+    function.argtypes = argtypes
+    function.restype = ctypes.c_int
+    return function
+
+
+_recvmmsg = _load_libc_function(
+    "recvmmsg", [ctypes.c_int, ctypes.POINTER(_MMsgHdr), ctypes.c_uint, ctypes.c_int, ctypes.c_void_p]
+)
+# Takes the messages' address, so sending can resume in the middle of the array
+_sendmmsg = _load_libc_function("sendmmsg", [ctypes.c_int, ctypes.c_void_p, ctypes.c_uint, ctypes.c_int])
+
+
+class BatchReceiver:
+    """
+    Receives datagrams from a UDP socket into pre-allocated buffers, using `recvmmsg` to
+    drain many datagrams per syscall on Linux and falling back to `recv_into` elsewhere.
+
+    In batched mode a blocking socket's timeout is moved into the kernel (SO_RCVTIMEO) and the fd is
+    made blocking, so each batch costs a single syscall during which the GIL is released. A non-blocking
+    socket, such as one driven by a selector, stays non-blocking and each call only returns what is queued.
+    SO_RXQ_OVFL is enabled as well, so datagrams dropped because the kernel receive buffer
+    overflowed are counted separately from datagrams lost on the wire, and so is SO_TIMESTAMPNS,
+    so transfers are timed by when the kernel received the datagrams rather than by when
+    Python got around to reading them.
+
+    Callers that only need the start of each datagram can limit how much of it is copied to
+    userspace, while still learning the datagram's full length (MSG_TRUNC).
+    """
+
+    def __init__(self, sock: socket.socket, buffers: List[bytearray], copy_size: Optional[int] = None):
+        """
+        :param sock: The bound UDP socket to receive from.
+        :param buffers: The datagram buffers to receive into, one per datagram in a batch.
+                        Only the first buffer is used when batching is unavailable.
+        :param copy_size: How many bytes of each datagram to copy into its buffer, the kernel discards the rest.
+                          Only honored in batched mode, otherwise whole datagrams are received.
+        """
+        self._sock = sock
+        self._batched = _recvmmsg is not None
+        self._nonblocking = sock.gettimeout() == 0
+        self._flags = socket.MSG_DONTWAIT if self._nonblocking else MSG_WAITFORONE
+        self.dropped_count = 0  # Datagrams the kernel dropped on this socket, stays 0 if the platform can't tell
+        self.last_timestamp_ns: Optional[int] = None  # Kernel receive time of the newest datagram, if available
+        if not self._batched:
+            buffers = buffers[:1]
+
+        self._buffers = buffers
+        self._views = [memoryview(buffer) for buffer in self._buffers]
+
+        if self._batched and copy_size is not None:
+            self._views = [view[:copy_size] for view in self._views]
+            self._flags |= socket.MSG_TRUNC  # msg_len still reports the full datagram length
+
+        if self._batched:
+            batch_size = len(buffers)
+            self._iovecs = (_IOVec * batch_size)()
+            self._messages = (_MMsgHdr * batch_size)()
+            self._c_buffers = [(ctypes.c_char * len(buffer)).from_buffer(buffer) for buffer in self._buffers]
+            for index, c_buffer in enumerate(self._c_buffers):
+                self._iovecs[index].iov_base = ctypes.addressof(c_buffer)
+                self._iovecs[index].iov_len = len(self._views[index])
+                self._messages[index].msg_hdr.msg_iov = ctypes.pointer(self._iovecs[index])
+                self._messages[index].msg_hdr.msg_iovlen = 1
+
+            self._control = (ctypes.c_char * (_CONTROL_SIZE * batch_size))()
+            for index in range(batch_size):
+                self._messages[index].msg_hdr.msg_control = ctypes.addressof(self._control) + index * _CONTROL_SIZE
+                self._messages[index].msg_hdr.msg_controllen = _CONTROL_SIZE
+            for option in (SO_RXQ_OVFL, SO_TIMESTAMPNS):
+                try:
+                    sock.setsockopt(socket.SOL_SOCKET, option, 1)
+                except OSError:
+                    pass  # Older kernels, the information just won't be reported
+
+            if not self._nonblocking:
+                timeout = sock.gettimeout() or 0  # No timeout, and a zero timeval blocks forever
+                seconds = int(timeout)
+                sock.setsockopt(
+                    socket.SOL_SOCKET, socket.SO_RCVTIMEO,
+                    struct.pack("ll", seconds, int((timeout - seconds) * 1_000_000))
+                )
+                os.set_blocking(sock.fileno(), True)
+
+    def receive(self) -> Tuple[List[memoryview], List[int]]:
+        """
+        Waits for datagrams and returns views over the ones received in this batch.
+        On a non-blocking socket it doesn't wait, and returns empty lists if no datagram is queued.
+        The views are only valid until the next call.
+
+        :return: A tuple containing a list of memoryviews, one per received datagram, and a list of the
+                 datagrams' full lengths, which exceed their views' lengths if `copy_size` truncated them.
+        :raises socket.timeout: If no datagram arrives within the socket's timeout.
+        """
+        if not self._batched:
+            try:
+                received = self._sock.recv_into(self._buffers[0])
+            except BlockingIOError:  # Only raised by non-blocking sockets
+                return [], []
+            return [self._views[0][:received]], [received]
+
+        while True:
+            count = _recvmmsg(self._sock.fileno(), self._messages, len(self._buffers), self._flags, None)
+            if count > 0:
+                self._read_control_messages(count - 1)  # Both values only matter for the newest datagram
+                lengths = [self._messages[index].msg_len for index in range(count)]
+                return [self._views[index][:length] for index, length in enumerate(lengths)], lengths
+            if count == 0:
+                return [], []
+
+            error = ctypes.get_errno()
+            if error == errno.EAGAIN:
+                if self._nonblocking:  # E.g. a selector reported a datagram that failed its checksum
+                    return [], []
+                raise socket.timeout("timed out")
+            if error != errno.EINTR:
+                raise OSError(error, os.strerror(error))
+
+    def _read_control_messages(self, last_index: int) -> None:
+        """
+        Reads the drop counter and receive time attached to a received datagram and re-arms the control buffers.
+
+        :param last_index: The index of the last datagram received in the batch.
+        """
+        offset = last_index * _CONTROL_SIZE
+        end = offset + self._messages[last_index].msg_hdr.msg_controllen
+        while offset + _CMSG_HEADER.size <= end:
+            length, level, message_type = _CMSG_HEADER.unpack_from(self._control, offset)
+            if length < _CMSG_HEADER.size:
+                break
+            if level == socket.SOL_SOCKET:
+                if message_type == SO_RXQ_OVFL:
+                    self.dropped_count, = _DROP_COUNTER.unpack_from(self._control, offset + _CMSG_HEADER.size)
+                elif message_type == SO_TIMESTAMPNS:
+                    seconds, nanoseconds = _TIMESPEC.unpack_from(self._control, offset + _CMSG_HEADER.size)
+                    self.last_timestamp_ns = seconds * 1_000_000_000 + nanoseconds
+            offset += socket.CMSG_SPACE(length - _CMSG_HEADER.size)
+
+        for index in range(last_index + 1):  # The kernel shrinks msg_controllen to what it wrote
+            self._messages[index].msg_hdr.msg_controllen = _CONTROL_SIZE
+
+
+class BatchSender:
+    """
+    Sends a fixed set of datagrams to one IPv4 address, using `sendmmsg` to hand many datagrams
+    to the kernel per syscall on Linux and falling back to one send per datagram elsewhere.
+
+    Each datagram is gathered from several buffers, so parts shared by every datagram (such as
+    a payload) are referenced rather than copied. The buffers may be modified between sends.
+    """
+
+    def __init__(self, sock: socket.socket, address: Tuple[str, int], messages: Sequence[Sequence[bytearray]]):
+        """
+        :param sock: The blocking UDP socket to send from.
+        :param address: The numeric IPv4 address and port to send to.
+        :param messages: The datagrams, each given as the buffers it is gathered from, in order.
+        """
+        self._sock = sock
+        self._address = address
+        self._parts = [list(parts) for parts in messages]
+        self._batched = _sendmmsg is not None
+
+        if self._batched:
+            ip, port = address
+            self._sockaddr = ctypes.create_string_buffer(
+                struct.pack("=H", socket.AF_INET) + struct.pack(">H", port) + socket.inet_aton(ip), 16
+            )  # struct sockaddr_in, zero padded
+            self._messages = (_MMsgHdr * len(self._parts))()
+            self._iovecs = []
+            self._c_buffers = []
+            for index, parts in enumerate(self._parts):
+                iovecs = (_IOVec * len(parts))()
+                for part_index, part in enumerate(parts):
+                    c_buffer = (ctypes.c_char * len(part)).from_buffer(part)
+                    self._c_buffers.append(c_buffer)
+                    iovecs[part_index].iov_base = ctypes.addressof(c_buffer)
+                    iovecs[part_index].iov_len = len(part)
+                self._iovecs.append(iovecs)
+                header = self._messages[index].msg_hdr
+                header.msg_name = ctypes.addressof(self._sockaddr)
+                header.msg_namelen = ctypes.sizeof(self._sockaddr)
+                header.msg_iov = iovecs
+                header.msg_iovlen = len(parts)
+
+    def send(self, count: int) -> None:
+        """
+        Sends the first `count` datagrams, blocking until the kernel accepted all of them.
+
+        :param count: The number of datagrams to send.
+        :raises OSError: If sending fails.
+        """
+        if not self._batched:
+            for parts in self._parts[:count]:
+                if hasattr(self._sock, "sendmsg"):  # Gathers without copying, missing on Windows
+                    self._sock.sendmsg(parts, (), 0, self._address)
+                else:
+                    self._sock.sendto(b"".join(parts), self._address)
+            return
+
+        sent = 0
+        messages_address = ctypes.addressof(self._messages)
+        message_size = ctypes.sizeof(_MMsgHdr)
+        while sent < count:
+            result = _sendmmsg(self._sock.fileno(), messages_address + sent * message_size, count - sent, 0)
+            if result >= 0:
+                sent += result
+                continue
+
+            error = ctypes.get_errno()
+            if error != errno.EINTR:
+                raise OSError(error, os.strerror(error))
+
@@ -0,0 +1,37 @@
+import queue
+
+
+class BufferPool:
+    """
+    A thread-safe pool of reusable, fixed-size receive buffers, so hot receive paths can use
+    `recv_into` without allocating a new bytes object per datagram.
+    """
+
+    def __init__(self, size: int, count: int):
+        """
+        :param size: The size of each buffer in bytes.
+        :param count: The number of buffers to pre-allocate.
+        """
+        self._size = size
+        self._buffers: queue.LifoQueue = queue.LifoQueue()  # LIFO keeps recently used (cache-warm) buffers on top
+        for _ in range(count):
+            self._buffers.put(bytearray(size))
+
+    def acquire(self) -> bytearray:
+        """
+        Takes a buffer from the pool, allocating a new one if the pool is exhausted.
+
+        :return: A buffer of the pool's size.
+        """
+        try:
+            return self._buffers.get_nowait()
+        except queue.Empty:
+            return bytearray(self._size)
+
+    def release(self, buffer: bytearray) -> None:
+        """
+        Returns a buffer to the pool.
+
+        :param buffer: A buffer previously returned by `acquire`.
+        """
+        self._buffers.put(buffer)
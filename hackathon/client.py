@@ -1,14 +1,26 @@
 import concurrent.futures
+import math
+import selectors
 import socket
-from datetime import datetime, timedelta
-from typing import Tuple
-
-from hackathon.color_printing import print_in_color, COLORS, print_error
-from hackathon.protocol import BROADCAST_PORT, parse_message, OFFER_MESSAGE_TYPE, build_message, REQUEST_MESSAGE_TYPE, \
-    TCP_MESSAGE_TERMINATOR, BUFFER_SIZE
-
-UDP_TIMEOUT = 1  # Timeout used for finishing udp download
+import statistics
+import time
+from typing import List, Sequence, Tuple
+
+from hackathon.batch_io import BatchReceiver, RECV_BATCH_SIZE
+from hackathon.buffer_pool import BufferPool
+from hackathon.socket_buffers import set_receive_buffer, set_tcp_receive_buffer
+from hackathon.color_printing import print_in_color, COLORS, print_error, print_debug, color_text, error_text, print_lines
+from hackathon.protocol import BROADCAST_PORT, parse_message, parse_offer_message, build_message, REQUEST_MESSAGE_TYPE, \
+    TCP_MESSAGE_TERMINATOR, BUFFER_SIZE, END_MESSAGE_TYPE, MAX_DATAGRAM_SIZE, parse_payload_length, \
+    PAYLOAD_HEADER_SIZE
+
+UDP_TIMEOUT = 1  # Safety net for finishing a udp download whose end message was lost
 BITS_IN_BYTE = 8  # Conversion factor for bytes to bits
+NANOSECONDS_IN_SECOND = 10 ** 9  # Conversion factor for perf_counter_ns readings
+SPEED_UNITS = ("bits/s", "Kib/s", "Mib/s", "Gib/s", "Tib/s", "Pib/s")  # 2^0 , 2^10..
+UDP_RCVBUF = 12 * 1024 * 1024  # Kernel receive buffer for UDP downloads (12 MiB, the common 10 GbE rmem_max tuning)
+TCP_RECV_BUFFER_SIZE = 1024 * 1024  # Scratch buffer TCP downloads are received into, the data itself is discarded
+TCP_RCVBUF = 4 * 1024 * 1024  # Minimum receive buffer for TCP downloads (the link's BDP), left to autotuning if it reaches it
 
 
 def main() -> None:
@@ -19,95 +31,138 @@ def main() -> None:
     file_size = get_positive_integer("Enter the file size to download (positive integer): ", include_zero=False)
     udp_connections_count = get_positive_integer("Enter the number of UDP connections (zero or positive integer): ")
     tcp_connections_count = get_positive_integer("Enter the number of TCP connections (zero or positive integer): ")
+    # One worker per TCP connection plus one shared by all UDP connections, so every download runs concurrently
+    workers_count = tcp_connections_count + (1 if udp_connections_count else 0)
+    if workers_count == 0:
+        print_error("No UDP or TCP connections requested, nothing to download.")
+        return
+
+    buffer_pool = BufferPool(size=MAX_DATAGRAM_SIZE, count=RECV_BATCH_SIZE)
+    # The request only depends on the file size, so it is built once and shared by every download
+    udp_request_message = build_message(REQUEST_MESSAGE_TYPE, file_size)
+    tcp_request_message = udp_request_message + TCP_MESSAGE_TERMINATOR
+
+    # One pool for the whole session, reused by every offer round
+    with concurrent.futures.ThreadPoolExecutor(
+        max_workers=workers_count, thread_name_prefix="download"
+    ) as executor, open_offer_socket() as offer_socket:
+        while True:
+            server_ip, udp_port, tcp_port = listen_for_offer(offer_socket)
+            print_in_color(f"Receive offer from {server_ip}", color=COLORS.GREEN)
 
-    while True:
-        server_ip, udp_port, tcp_port = listen_for_offer()
-        print_in_color(f"Receive offer from {server_ip}", color=COLORS.GREEN)
-
-        with concurrent.futures.ThreadPoolExecutor() as executor:
-            udp_futures = [
-                executor.submit(
-                    perform_udp_download,
-                    server_ip=server_ip, server_port=udp_port, download_size=file_size
-                ) for _ in range(udp_connections_count)
-            ]
+            udp_futures = submit_udp_downloads(
+                executor,
+                server_ip=server_ip, server_port=udp_port, request_message=udp_request_message,
+                connections_count=udp_connections_count, buffer_pool=buffer_pool
+            )
             tcp_futures = [
                 executor.submit(
                     perform_tcp_download,
-                    server_ip=server_ip, server_port=tcp_port, download_size=file_size
+                    server_ip=server_ip, server_port=tcp_port,
+                    download_size=file_size, request_message=tcp_request_message
                 ) for _ in range(tcp_connections_count)
             ]
 
-            process_tcp_results(tcp_futures)
-            process_udp_results(udp_futures)
+            process_results(tcp_futures, udp_futures)
 
-        print_in_color("All transfers complete, listening to offer requests", color=COLORS.GREEN)
+            print_in_color("All transfers complete, listening to offer requests", color=COLORS.GREEN)
 
 
-def process_tcp_results(tcp_futures: list) -> None:
+def process_results(tcp_futures: list, udp_futures: list) -> None:
     """
-    Processes the results of TCP download futures.
+    Processes the results of TCP and UDP download futures together, printing each result as soon as
+    its transfer completes, so neither protocol's results wait behind the other's.
 
     :param tcp_futures: A list of futures representing TCP downloads.
+    :param udp_futures: A list of futures representing UDP downloads.
     """
-    all_speeds = []
-    for index, future in enumerate(concurrent.futures.as_completed(tcp_futures)):
+    protocols = {**{future: "TCP" for future in tcp_futures}, **{future: "UDP" for future in udp_futures}}
+    finished_counts = {"TCP": 0, "UDP": 0}
+    tcp_speeds = []
+    udp_speeds = []
+    udp_percentages_received = []
+    summary_lines = []
+
+    for future in concurrent.futures.as_completed(protocols):
+        protocol = protocols[future]
+        finished_counts[protocol] += 1
+        index = finished_counts[protocol]
         try:
-            duration, total_data_received = future.result()
-            speed = total_data_received * BITS_IN_BYTE / duration
-            print_in_color(
-                f"TCP transfer #{index + 1} finished, total time: {duration} seconds, total speed: {humanize_speed(speed)}",
-                color=COLORS.LIGHTBLACK_EX
-            )
-            all_speeds.append(speed)
+            if protocol == "TCP":
+                line, speed = describe_tcp_result(index, future.result())
+                tcp_speeds.append(speed)
+            else:
+                line, speed, percentage_received = describe_udp_result(index, future.result())
+                udp_speeds.append(speed)
+                udp_percentages_received.append(percentage_received)
+            print_lines([color_text(line, color=COLORS.LIGHTBLACK_EX)], flush=False)
         except Exception as e:
-            print_error(f"An error occurred in a TCP task #{index}: {e}")
-    
-    if all_speeds:
-        max_speed = max(all_speeds)
-        min_speed = min(all_speeds)
-        avg_speed = sum(all_speeds) / len(all_speeds)
-        print_in_color(
+            print_lines([error_text(f"An error occurred in a {protocol} task #{index}: {e}")], flush=False)
+
+    if tcp_speeds:
+        max_speed, min_speed, avg_speed = summarize_speeds(tcp_speeds)
+        summary_lines.append(color_text(
             f"TCP transfers summary:\n\tMax speed: {humanize_speed(max_speed)}\n\tMin speed: {humanize_speed(min_speed)}\n\t"
             f"Average speed: {humanize_speed(avg_speed)}",
             color=COLORS.CYAN
-        )
-    
-    
+        ))
+
+    if udp_speeds:
+        max_speed, min_speed, avg_speed = summarize_speeds(udp_speeds)
+        avg_loss = 100 - statistics.fmean(udp_percentages_received)  # Same length as udp_speeds, so never empty
+        summary_lines.append(color_text(
+            f"UDP transfers summary:\n\tMax speed: {humanize_speed(max_speed)}\n\tMin speed: {humanize_speed(min_speed)}\n\t"
+            f"Average speed: {humanize_speed(avg_speed)}\n\tAverage packet loss: {avg_loss}%",
+            color=COLORS.CYAN
+        ))
+
+    print_lines(summary_lines)  # Both summaries in a single write, flushing the per-transfer lines with them
+
 
-def process_udp_results(udp_futures: list) -> None:
+def describe_tcp_result(index: int, result: Tuple[float, int]) -> Tuple[str, float]:
     """
-    Processes the results of UDP download futures.
+    Describes the result of a TCP download.
 
-    :param udp_futures: A list of futures representing UDP downloads.
+    :param index: The transfer's number.
+    :param result: The TCP download's result.
+    :return: A tuple containing the description line and the transfer speed in bits/second.
     """
-    all_speeds = []
-    total_percentage_received = []
-    for index, future in enumerate(concurrent.futures.as_completed(udp_futures)):
-        try:
-            duration, total_data_received, segments_received_count, expected_segments_count = future.result()
-            speed = total_data_received * BITS_IN_BYTE / duration
-            percentage_received = (segments_received_count / expected_segments_count) * 100 if expected_segments_count > 0 else 0
-            print_in_color(
-                f"UDP transfer #{index + 1} finished, total time: {duration} seconds, total speed: {humanize_speed(speed)}, percentage of packets received: {percentage_received}%",
-                color=COLORS.LIGHTBLACK_EX
-            )
+    duration, total_data_received = result
+    speed = total_data_received * BITS_IN_BYTE / duration
+    line = f"TCP transfer #{index} finished, total time: {duration} seconds, total speed: {humanize_speed(speed)}"
+    return line, speed
 
-            all_speeds.append(speed)
-            total_percentage_received.append(percentage_received)
-        except Exception as e:
-            print_error(f"An error occurred in a UDP task: {e}")
-
-    if all_speeds:
-        max_speed = max(all_speeds)
-        min_speed = min(all_speeds)
-        avg_speed = sum(all_speeds) / len(all_speeds)
-        avg_loss = 100 - (sum(total_percentage_received) / len(total_percentage_received) if total_percentage_received else 0)
-        print_in_color(
-            f"UDP transfers summary:\n\tMax speed: {humanize_speed(max_speed)}\n\tMin speed: {humanize_speed(min_speed)}\n\t"
-            f"Average speed: {humanize_speed(avg_speed)}\n\tAverage packet loss: {avg_loss}%",
-            color=COLORS.CYAN
-        )
+
+def describe_udp_result(index: int, result: Tuple[float, int, int, int, int]) -> Tuple[str, float, float]:
+    """
+    Describes the result of a UDP download.
+
+    :param index: The transfer's number.
+    :param result: The UDP download's result, as described in `UdpDownload.resolve`.
+    :return: A tuple containing the description line, the transfer speed in bits/second
+             and the percentage of packets received.
+    """
+    duration, total_data_received, segments_received_count, expected_segments_count, kernel_dropped_count = result
+    # A download that received nothing has no duration, it is reported as 0 bits/s and still counts towards the loss
+    speed = total_data_received * BITS_IN_BYTE / duration if duration > 0 and segments_received_count > 0 else 0
+    percentage_received = (segments_received_count / expected_segments_count) * 100 if expected_segments_count > 0 else 0
+    # Whatever the local kernel didn't drop was lost on the way (network or sender)
+    wire_dropped_count = max(0, expected_segments_count - segments_received_count - kernel_dropped_count)
+    line = (
+        f"UDP transfer #{index} finished, total time: {duration} seconds, total speed: {humanize_speed(speed)}, percentage of packets received: {percentage_received}%, "
+        f"packets dropped by the kernel: {kernel_dropped_count}, packets lost on the wire: {wire_dropped_count}"
+    )
+    return line, speed, percentage_received
+
+
+def summarize_speeds(speeds: Sequence[float]) -> Tuple[float, float, float]:
+    """
+    Computes the summary statistics of a non-empty sequence of transfer speeds.
+
+    :param speeds: The speeds in bits/second.
+    :return: A tuple containing the maximum, minimum and average speed.
+    """
+    return max(speeds), min(speeds), statistics.fmean(speeds)
 
 
 def get_positive_integer(message: str, include_zero: bool = True) -> int:
@@ -136,112 +191,269 @@ def humanize_speed(bits_per_second: float) -> str:
     :param bits_per_second: The speed in bits/second.
     :return: A string representing the human-readable speed.
     """
-    units = ["bits/s", "Kib/s", "Mib/s", "Gib/s", "Tib/s", "Pib/s"]  # 2^0 , 2^10..
-    scale = 1024  # Using base 2 (Kibi)
-    for unit in units:
-        if bits_per_second < scale:
-            return f"{bits_per_second:.2f} {unit}"
-        bits_per_second /= scale
-    return f"{bits_per_second:.2f} {units[-1]}"
+    # Each unit is 2^10 (Kibi) times the previous one, so the unit index is floor(log2(speed) / 10)
+    unit_index = min(len(SPEED_UNITS) - 1, int(math.log2(bits_per_second)) // 10) if bits_per_second >= 1 else 0
+    return f"{bits_per_second / (1 << (unit_index * 10)):.2f} {SPEED_UNITS[unit_index]}"
+
+
+def open_offer_socket() -> socket.socket:
+    """
+    Opens the UDP socket offers are received on. It is opened once and kept across offer rounds,
+    so no broadcast is missed while rebinding.
 
+    :return: A UDP socket bound to the broadcast port.
+    """
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)  # Open UDP Socket (IP, UDP)
+    try:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        if hasattr(socket, "SO_REUSEPORT"):  # Lets several listeners share the port, the kernel spreads datagrams
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        sock.bind(("", BROADCAST_PORT))  # Listen to BROADCAST_PORT
+    except OSError:
+        sock.close()
+        raise
+    return sock
 
-def listen_for_offer() -> Tuple[str, int, int]:
+
+def listen_for_offer(sock: socket.socket) -> Tuple[str, int, int]:
     """
     Listens for and returns a valid offer message.
 
+    :param sock: The socket offers are received on, see `open_offer_socket`.
     :return: A tuple containing the server address, UDP port, and TCP port.
     """
     print_in_color("Client started, listening for offer requests...", color=COLORS.GREEN)
 
-    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:  # Open UDP Socket (IP, UDP)
-        sock.bind(("", BROADCAST_PORT))  # Listen to BROADCAST_PORT
+    offer_buffer = bytearray(BUFFER_SIZE)
+    offer_view = memoryview(offer_buffer)
+    discard_queued_offers(sock, offer_buffer)
+    while True:
+        received, (server_ip, server_port) = sock.recvfrom_into(offer_buffer)
+        offer_message = offer_view[:received]
+        try:
+            udp_port, tcp_port = parse_offer_message(offer_message)  # Parsed once, validated and unpacked together
+        except ValueError as e:
+            print_debug("Got invalid offer message - %s. Keep trying...", e)
+            continue
 
-        while True:
-            offer_message, (server_ip, server_port) = sock.recvfrom(BUFFER_SIZE)
-            if is_valid_offer(offer_message):
-                message_type, (udp_port, tcp_port) = parse_message(offer_message)
-                return server_ip, udp_port, tcp_port
+        return server_ip, udp_port, tcp_port
 
 
-def is_valid_offer(offer_message: bytes) -> bool:
+def discard_queued_offers(sock: socket.socket, buffer: bytearray) -> None:
     """
-    Validates an offer message.
+    Discards the offers that queued up on the offer socket while it wasn't read, e.g. during downloads,
+    so that only offers sent from now on are answered, by servers that are still up.
 
-    :param offer_message: The raw offer message.
-    :return: True if the offer is valid, False otherwise.
+    :param sock: The socket offers are received on, see `open_offer_socket`.
+    :param buffer: A buffer to read the discarded offers into.
     """
+    sock.setblocking(False)
     try:
-        message_type, *_ = parse_message(offer_message)
-        return message_type == OFFER_MESSAGE_TYPE
-    except ValueError as e:
-        print_in_color(f"DBG: Got invalid offer message - {e}. Keep trying...", color=COLORS.LIGHTYELLOW_EX)
-        return False
+        while True:
+            sock.recv_into(buffer)
+    except BlockingIOError:
+        pass  # The queue is empty
+    finally:
+        sock.setblocking(True)
 
 
-def perform_udp_download(server_ip: str, server_port: int, download_size: int) -> Tuple[float, int, int, int]:
+class UdpDownload:
     """
-    Measures the performance of a UDP download.
-
-    :param server_ip: The server's address.
-    :param server_port: The UDP port to connect to.
-    :param download_size: The size of the file to download.
-    :return: A tuple containing the duration of the transfer, total data received,
-             total segments received, and the total number of segments expected.
+    The state of a single UDP download driven by `perform_udp_downloads`.
     """
-    request_message = build_message(REQUEST_MESSAGE_TYPE, download_size)
-
-    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
-        sock.bind(("", 0))
-        sock.settimeout(UDP_TIMEOUT)
-
-        sock.sendto(request_message, (server_ip, server_port))
 
-        segments_received_count = 0
-        expected_segments_count = 1
-        total_data_received = 0
-
-        start_time = datetime.now()
-
-        while True:
+    def __init__(self, sock: socket.socket, receiver: BatchReceiver, future: concurrent.futures.Future):
+        """
+        :param sock: The download's bound UDP socket.
+        :param receiver: The receiver reading from the socket.
+        :param future: The future resolved with the download's result once it finishes.
+        """
+        self.sock = sock
+        self.receiver = receiver
+        self.future = future
+        self.segments_received_count = 0
+        self.expected_segments_count = 1
+        self.total_data_received = 0
+        self.finished = False
+        self.start_ns = time.perf_counter_ns()
+        self.end_ns = self.start_ns  # Time of the last received datagram, so a timeout isn't billed to the transfer
+        self.start_wall_ns = time.time_ns()  # Same instant on the clock kernel receive timestamps use
+
+    def receive(self) -> None:
+        """
+        Receives and accounts for the datagrams waiting on the socket.
+        """
+        messages, lengths = self.receiver.receive()
+        if not messages:  # Woken up without a datagram to read
+            return
+        self.end_ns = time.perf_counter_ns()
+
+        # Work on locals for the batch, so the per-datagram loop uses fast local lookups
+        # instead of global and attribute lookups
+        parse_payload = parse_payload_length
+        segments_received_count = self.segments_received_count
+        expected_segments_count = self.expected_segments_count
+        total_data_received = self.total_data_received
+
+        for message, length in zip(messages, lengths):
             try:
-                message = sock.recv(BUFFER_SIZE)
-                message_type, (expected_segments_count, current_segment, payload) = parse_message(message)
+                expected_segments_count, payload_length = parse_payload(message, length)
                 segments_received_count += 1
-                total_data_received += len(payload)
-            except socket.timeout:
-                break
+                total_data_received += payload_length
+                continue
+            except ValueError:
+                pass  # Not a valid payload message, the generic parser below tells which
+
+            try:
+                message_type, body = parse_message(message)
             except ValueError as e:
                 print_error(f"Corrupted Message: {e}")
+                continue
+
+            if message_type == END_MESSAGE_TYPE:
+                expected_segments_count, = body
+                self.finished = True
+
+        self.segments_received_count = segments_received_count
+        self.expected_segments_count = expected_segments_count
+        self.total_data_received = total_data_received
+        if segments_received_count == expected_segments_count:
+            self.finished = True
+
+    def resolve(self) -> None:
+        """
+        Resolves the future with a tuple containing the duration of the transfer, total data received,
+        total segments received, the total number of segments expected, and the number of segments
+        dropped by the local kernel because the receive buffer overflowed.
+        """
+        duration_ns = self.end_ns - self.start_ns
+        last_timestamp_ns = self.receiver.last_timestamp_ns
+        if last_timestamp_ns is not None and last_timestamp_ns > self.start_wall_ns:
+            # The kernel's receive time leaves out how long the last datagram waited to be read
+            duration_ns = last_timestamp_ns - self.start_wall_ns
+        duration_seconds = duration_ns / NANOSECONDS_IN_SECOND
+        self.future.set_result((
+            duration_seconds, self.total_data_received, self.segments_received_count, self.expected_segments_count,
+            self.receiver.dropped_count
+        ))
+
+
+def submit_udp_downloads(executor: concurrent.futures.Executor, server_ip: str, server_port: int,
+                         request_message: bytes, connections_count: int,
+                         buffer_pool: BufferPool) -> List[concurrent.futures.Future]:
+    """
+    Starts UDP downloads that all run on a single executor thread.
+
+    :param executor: The executor running the downloads.
+    :param server_ip: The server's address.
+    :param server_port: The UDP port to connect to.
+    :param request_message: The prebuilt request message sent to the server.
+    :param connections_count: The number of parallel UDP downloads.
+    :param buffer_pool: The pool providing the receive buffers.
+    :return: A list of futures, one per download, each resolved with the tuple described in `UdpDownload.resolve`.
+    """
+    udp_futures = [concurrent.futures.Future() for _ in range(connections_count)]
+    if udp_futures:
+        executor.submit(
+            perform_udp_downloads,
+            server_ip=server_ip, server_port=server_port, request_message=request_message,
+            udp_futures=udp_futures, buffer_pool=buffer_pool
+        )
+    return udp_futures
 
-        end_time = datetime.now()
 
-        duration_seconds = (end_time - start_time - timedelta(seconds=UDP_TIMEOUT)).total_seconds()
-        return duration_seconds, total_data_received, segments_received_count, expected_segments_count
+def perform_udp_downloads(server_ip: str, server_port: int, request_message: bytes,
+                          udp_futures: List[concurrent.futures.Future], buffer_pool: BufferPool) -> None:
+    """
+    Measures the performance of parallel UDP downloads from a single thread, reading whichever
+    socket is ready via the platform's selector (epoll/kqueue).
 
+    :param server_ip: The server's address.
+    :param server_port: The UDP port to connect to.
+    :param request_message: The prebuilt request message sent to the server.
+    :param udp_futures: The futures to resolve, one per download, with the tuple described in
+                        `UdpDownload.resolve`.
+    :param buffer_pool: The pool providing the receive buffers.
+    """
+    timeout_ns = UDP_TIMEOUT * NANOSECONDS_IN_SECOND
+    downloads: List[UdpDownload] = []
+    # Downloads are processed one at a time, so they all share a single set of receive buffers
+    buffers = [buffer_pool.acquire() for _ in range(RECV_BATCH_SIZE)]
 
-def perform_tcp_download(server_ip: str, server_port: int, download_size: int) -> Tuple[float, int]:
+    try:
+        with selectors.DefaultSelector() as selector:
+            for future in udp_futures:
+                sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+                sock.setblocking(False)  # The selector waits, so a spurious wakeup can't block the other downloads
+                # Only the headers are needed to count the payload bytes, so the payloads aren't copied
+                receiver = BatchReceiver(sock, buffers, copy_size=PAYLOAD_HEADER_SIZE)
+                downloads.append(UdpDownload(sock, receiver, future))
+                sock.bind(("", 0))
+                set_receive_buffer(sock, UDP_RCVBUF)
+                selector.register(sock, selectors.EVENT_READ, data=downloads[-1])
+
+            for download in downloads:
+                download.sock.sendto(request_message, (server_ip, server_port))
+                download.start_ns = download.end_ns = time.perf_counter_ns()
+                download.start_wall_ns = time.time_ns()
+
+            while selector.get_map():
+                for key, _ in selector.select(timeout=UDP_TIMEOUT):
+                    download = key.data
+                    download.receive()
+                    if download.finished:
+                        selector.unregister(download.sock)
+                        download.resolve()
+
+                now_ns = time.perf_counter_ns()
+                for key in list(selector.get_map().values()):
+                    if now_ns - key.data.end_ns >= timeout_ns:  # The download's end message was lost
+                        selector.unregister(key.fileobj)
+                        key.data.resolve()
+    except Exception as e:
+        for future in udp_futures:
+            if not future.done():
+                future.set_exception(e)
+    finally:
+        for download in downloads:
+            download.sock.close()
+        for buffer in buffers:
+            buffer_pool.release(buffer)
+
+
+def perform_tcp_download(server_ip: str, server_port: int, download_size: int,
+                         request_message: bytes) -> Tuple[float, int]:
     """
     Measures the performance of a TCP download.
 
     :param server_ip: The server's address.
     :param server_port: The TCP port to connect to.
     :param download_size: The size of the file to download.
+    :param request_message: The prebuilt request message, including the TCP terminator.
     :return: A tuple containing the duration of the transfer and the total data received.
     """
-    request_message = build_message(REQUEST_MESSAGE_TYPE, download_size, payload=TCP_MESSAGE_TERMINATOR)
-
     with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:  # Open TCP Socket (IP, TCP)
+        set_tcp_receive_buffer(sock, TCP_RCVBUF)  # Must be set before connect so the window scale is negotiated
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)  # Don't let Nagle hold back the small request
         sock.connect((server_ip, server_port))
         sock.sendall(request_message)
 
-        start_time = datetime.now()
+        # Allocated outside the timed region, and overwritten by every receive since only the byte count matters
+        scratch_view = memoryview(bytearray(TCP_RECV_BUFFER_SIZE))
+        total_data_received = 0
+
+        start_ns = time.perf_counter_ns()
 
-        response = sock.recv(download_size)  # could be problematic with larger files
+        while total_data_received < download_size:  # A single recv only returns what the kernel has buffered
+            received = sock.recv_into(scratch_view[:min(TCP_RECV_BUFFER_SIZE, download_size - total_data_received)])
+            if received == 0:  # Server closed the connection
+                break
+            total_data_received += received
 
-        end_time = datetime.now()
+        end_ns = time.perf_counter_ns()
 
-        duration_seconds = (end_time - start_time).total_seconds()
-        return duration_seconds, len(response)
+        duration_seconds = (end_ns - start_ns) / NANOSECONDS_IN_SECOND
+        return duration_seconds, total_data_received
 
 
 if __name__ == '__main__':
@@ -1,12 +1,44 @@
+import sys
+from typing import List
+
 from colorama import init as colorama_init
 from colorama import Fore, Style
 
 COLORS = Fore
-colorama_init(autoreset=True)
+DEBUG = False  # Enables the DBG prints, keep off when measuring so stdout writes don't skew the results
+colorama_init(autoreset=True)  # Also strips the color codes when stdout isn't a terminal
 
 def print_in_color(text: str, color: Fore = COLORS.RESET):
     print(f"{color}{text}")
 
 
 def print_error(text: str):
-    print_in_color(f"{Style.BRIGHT}{text}", COLORS.RED)
\ No newline at end of file
+    print_in_color(f"{Style.BRIGHT}{text}", COLORS.RED)
+
+
+def print_debug(text: str, *args):
+    """
+    Prints a debug line if DEBUG is on. The text is %-formatted with `args` only then,
+    so callers on per-event paths pay nothing for formatting while DEBUG is off.
+    """
+    if DEBUG:
+        print_in_color(f"DBG: {text % args if args else text}", COLORS.LIGHTYELLOW_EX)
+
+
+def color_text(text: str, color: Fore = COLORS.RESET) -> str:
+    return f"{color}{text}{Style.RESET_ALL}"  # Reset explicitly, autoreset only applies once per write
+
+
+def error_text(text: str) -> str:
+    return color_text(f"{Style.BRIGHT}{text}", COLORS.RED)
+
+
+def print_lines(lines: List[str], flush: bool = True):
+    """
+    Writes several (possibly colored) lines with a single write, so stdout is locked and flushed once.
+    Pass flush=False to leave flushing to a later call, e.g. when writing one line per event in a loop.
+    """
+    if lines:
+        sys.stdout.write("\n".join(lines) + "\n")
+    if flush:
+        sys.stdout.flush()
@@ -1,64 +1,107 @@
+import functools
 import struct
-from typing import Any, Tuple, Union, Dict
+from typing import Any, Callable, Dict, List, Optional, Tuple, Union
 
 # TODO: Ask big/little indian.
 
 # Constants
 BROADCAST_PORT: int = 12345  # Port used for broadcasting
-TCP_MESSAGE_TERMINATOR = "\n".encode()  # Terminator for TCP request messages
+TCP_MESSAGE_TERMINATOR = b"\n"  # Terminator for TCP request messages
 BUFFER_SIZE = 1024  # Socket buffer size
+MAX_DATAGRAM_SIZE = 9216  # Receive buffer size for UDP payloads, admits jumbo-frame (MTU 9000) datagrams
 
 # Header format
 MAGIC_COOKIE: bytes = 0xabcddcba.to_bytes(4, byteorder="big")  # Magic cookie for protocol validation
+MAGIC_COOKIE_SIZE: int = len(MAGIC_COOKIE)  # The message type byte follows the cookie
 HEADER_FORMAT: str = "4sB"  # Protocol (4 bytes) + Message Type (1 byte) - struct format
-HEADER_SIZE: int = struct.calcsize(HEADER_FORMAT)  # Size of the header in bytes
+HEADER_STRUCT: struct.Struct = struct.Struct(HEADER_FORMAT)  # Compiled once, so parsing skips the format cache
+HEADER_SIZE: int = HEADER_STRUCT.size  # Size of the header in bytes
 
 # Message types
 OFFER_MESSAGE_TYPE: int = 0x2
 REQUEST_MESSAGE_TYPE: int = 0x3
 PAYLOAD_MESSAGE_TYPE: int = 0x4
+END_MESSAGE_TYPE: int = 0x5  # Marks the end of a UDP transfer so the client doesn't wait for a timeout
+
+# Any object supporting the buffer protocol, so receive buffers can be parsed without copying
+Buffer = Union[bytes, bytearray, memoryview]
 
 # Message formats
 MESSAGES_FORMATS: Dict[int, str] = {
     OFFER_MESSAGE_TYPE: ">HH",
     REQUEST_MESSAGE_TYPE: ">Q",
     PAYLOAD_MESSAGE_TYPE: ">QQ",
+    END_MESSAGE_TYPE: ">Q",  # Total segments sent
+}
+MESSAGES_STRUCTS: Dict[int, struct.Struct] = {
+    message_type: struct.Struct(message_format) for message_type, message_format in MESSAGES_FORMATS.items()
 }
+# Header and fixed body fields fused into one format, so a message is packed with a single call
+FULL_MESSAGES_STRUCTS: Dict[int, struct.Struct] = {
+    message_type: struct.Struct(f">{HEADER_FORMAT}{message_format.lstrip('>')}")
+    for message_type, message_format in MESSAGES_FORMATS.items()
+}
+
+_PAYLOAD_BODY_STRUCT: struct.Struct = MESSAGES_STRUCTS[PAYLOAD_MESSAGE_TYPE]  # Total segments + segment number
+# Size of everything in a payload message before the payload itself (header + total segments + segment number)
+PAYLOAD_HEADER_SIZE: int = HEADER_SIZE + _PAYLOAD_BODY_STRUCT.size
+REQUEST_MESSAGE_SIZE: int = FULL_MESSAGES_STRUCTS[REQUEST_MESSAGE_TYPE].size  # Header + file size
+# The segment number is the last fixed field and the only one that changes between a transfer's payload messages
+SEGMENT_NUMBER_STRUCT: struct.Struct = struct.Struct(">Q")
+SEGMENT_NUMBER_OFFSET: int = PAYLOAD_HEADER_SIZE - SEGMENT_NUMBER_STRUCT.size
 
-def parse_message(data: bytes) -> Tuple[int, Union[Tuple[Any, ...], None]]:
+def _parse_fixed_body(body_struct: struct.Struct, data: Buffer) -> Tuple[Any, ...]:
     """
-    Parses a message and returns its type and associated data.
+    Parses the fixed-length body following the header.
 
+    :param body_struct: The compiled format of the body.
     :param data: The raw message data.
-    :return: A tuple containing the message type and parsed values, or None if no body exists.
-    :raises ValueError: If the message cannot be parsed due to invalid format or type.
+    :return: The parsed body values.
+    :raises ValueError: If the data is too short to contain the body.
     """
-    message_type = parse_header(data)
+    if len(data) - HEADER_SIZE < body_struct.size:
+        raise ValueError("Data too short to contain a valid message body.")
+    return body_struct.unpack_from(data, HEADER_SIZE)
+
+
+def _parse_payload_body(data: Buffer) -> Tuple[Any, ...]:
+    """
+    Parses the body of a payload message, whose variable-length payload follows the fixed fields.
+
+    :param data: The raw message data.
+    :return: The parsed body values, followed by the payload as a memoryview over `data`.
+    :raises ValueError: If the data is too short to contain the body.
+    """
+    return (*_parse_fixed_body(_PAYLOAD_BODY_STRUCT, data), memoryview(data)[PAYLOAD_HEADER_SIZE:])
 
-    if message_type in MESSAGES_FORMATS:
-        body_format = MESSAGES_FORMATS[message_type]
-        body_size = struct.calcsize(body_format)
-        body_data = data[HEADER_SIZE:]
 
-        if len(body_data) < body_size:
-            raise ValueError("Data too short to contain a valid message body.")
+# Body parsers indexed by message type, the types are small integers so a list beats a dict lookup
+_BODY_PARSERS: List[Optional[Callable[[Buffer], Tuple[Any, ...]]]] = [None] * (max(MESSAGES_STRUCTS) + 1)
+for _message_type, _body_struct in MESSAGES_STRUCTS.items():
+    _BODY_PARSERS[_message_type] = functools.partial(_parse_fixed_body, _body_struct)
+_BODY_PARSERS[PAYLOAD_MESSAGE_TYPE] = _parse_payload_body
 
-        try:
-            parsed_body = struct.unpack(body_format, body_data[:body_size])  # returns Tuple by the struct format
-        except struct.error as e:
-            raise ValueError(f"Failed to unpack message body for type {message_type}: {e}")
 
-        # Handle variable-length payloads for the payload message type
-        if message_type == PAYLOAD_MESSAGE_TYPE:
-            payload = body_data[body_size:]
-            return message_type, (*parsed_body, payload)
+def parse_message(data: Buffer) -> Tuple[int, Union[Tuple[Any, ...], None]]:
+    """
+    Parses a message and returns its type and associated data.
+    The data is read in place, so a memoryview over a receive buffer is parsed without copying.
 
-        return message_type, parsed_body
+    :param data: The raw message data.
+    :return: A tuple containing the message type and parsed values, or None if no body exists.
+             The payload of a payload message is returned as a memoryview over `data`.
+    :raises ValueError: If the message cannot be parsed due to invalid format or type.
+    """
+    message_type = parse_header(data)
+
+    body_parser = _BODY_PARSERS[message_type] if message_type < len(_BODY_PARSERS) else None
+    if body_parser is None:
+        raise ValueError(f"Unsupported message type: {message_type}")
 
-    raise ValueError(f"Unsupported message type: {message_type}")
+    return message_type, body_parser(data)
 
 
-def parse_header(data: bytes) -> int:
+def parse_header(data: Buffer) -> int:
     """
     Parses the header of a message and validates the magic cookie.
 
@@ -69,14 +112,11 @@ def parse_header(data: bytes) -> int:
     if len(data) < HEADER_SIZE:
         raise ValueError("Data too short to contain a valid header.")
 
-    try:
-        magic_cookie, message_type = struct.unpack(HEADER_FORMAT, data[:HEADER_SIZE])
-        if magic_cookie != MAGIC_COOKIE:
-            raise ValueError("Invalid magic cookie.")
-    except struct.error as e:
-        raise ValueError(f"Failed to parse header: {e}")
+    # A plain memcmp and an index, instead of unpacking the header into a new bytes object and tuple
+    if data[:MAGIC_COOKIE_SIZE] != MAGIC_COOKIE:
+        raise ValueError("Invalid magic cookie.")
 
-    return message_type
+    return data[MAGIC_COOKIE_SIZE]
 
 
 def build_message(message_type: int, *args: Any, payload: bytes = b"") -> bytes:
@@ -89,15 +129,39 @@ def build_message(message_type: int, *args: Any, payload: bytes = b"") -> bytes:
     :return: The constructed message as bytes.
     :raises ValueError: If packing the message fails or the message type is unsupported.
     """
-    if message_type not in MESSAGES_FORMATS:
+    message_struct = FULL_MESSAGES_STRUCTS.get(message_type)
+    if message_struct is None:
+        raise ValueError(f"Unsupported message type: {message_type}")
+
+    try:
+        message = message_struct.pack(MAGIC_COOKIE, message_type, *args)
+    except struct.error as e:
+        raise ValueError(f"Failed to pack values {args} with type '{message_type}': {e}")
+
+    return message + payload if payload else message
+
+
+def build_message_into(buffer: bytearray, message_type: int, *args: Any) -> int:
+    """
+    Writes the header and fixed body fields of a message to the start of a caller-owned buffer,
+    so senders can reuse one buffer and keep a variable-length payload in place after them.
+
+    :param buffer: The buffer to write into.
+    :param message_type: The type of the message.
+    :param args: Fixed fields for the message body.
+    :return: The number of bytes written, i.e. the offset where the payload starts.
+    :raises ValueError: If packing the message fails or the message type is unsupported.
+    """
+    message_struct = FULL_MESSAGES_STRUCTS.get(message_type)
+    if message_struct is None:
         raise ValueError(f"Unsupported message type: {message_type}")
 
     try:
-        body = struct.pack(MESSAGES_FORMATS[message_type], *args) + payload
+        message_struct.pack_into(buffer, 0, MAGIC_COOKIE, message_type, *args)
     except struct.error as e:
         raise ValueError(f"Failed to pack values {args} with type '{message_type}': {e}")
 
-    return build_header(message_type) + body
+    return message_struct.size
 
 
 def build_header(message_type: int) -> bytes:
@@ -109,13 +173,57 @@ def build_header(message_type: int) -> bytes:
     :raises ValueError: If packing the header fails.
     """
     try:
-        return struct.pack(HEADER_FORMAT, MAGIC_COOKIE, message_type)
+        return HEADER_STRUCT.pack(MAGIC_COOKIE, message_type)
     except struct.error as e:
         raise ValueError(f"Failed to pack header with type '{message_type}': {e}")
 
 
-def parse_request_message(message: bytes) -> int:
-    message_type, body = parse_message(message)
+def parse_request_message(message: Buffer) -> int:
+    try:
+        # Header and body in one unpack, like offers, instead of a header parse and a body dispatch
+        magic_cookie, message_type, file_size = FULL_MESSAGES_STRUCTS[REQUEST_MESSAGE_TYPE].unpack_from(message, 0)
+    except struct.error as e:
+        raise ValueError(f"Failed to parse request message: {e}")
+    if magic_cookie != MAGIC_COOKIE:
+        raise ValueError("Invalid magic cookie.")
     if message_type != REQUEST_MESSAGE_TYPE:
         raise ValueError(f"Got wrong message type, expected {REQUEST_MESSAGE_TYPE} and got {message_type}.")
-    return body[0]
+    return file_size
+
+
+def parse_offer_message(message: Buffer) -> Tuple[int, int]:
+    try:
+        # Header and body in one unpack, offers are checked for every broadcast received
+        magic_cookie, message_type, udp_port, tcp_port = FULL_MESSAGES_STRUCTS[OFFER_MESSAGE_TYPE].unpack_from(message, 0)
+    except struct.error as e:
+        raise ValueError(f"Failed to parse offer message: {e}")
+    if magic_cookie != MAGIC_COOKIE:
+        raise ValueError("Invalid magic cookie.")
+    if message_type != OFFER_MESSAGE_TYPE:
+        raise ValueError(f"Got wrong message type, expected {OFFER_MESSAGE_TYPE} and got {message_type}.")
+    return udp_port, tcp_port
+
+
+def parse_payload_length(message: Buffer, message_length: Optional[int] = None) -> Tuple[int, int]:
+    """
+    Fast path for the UDP receive loop: reads a payload message's total segments count and payload length
+    without materializing the payload or the unused segment number.
+
+    :param message: The raw message data, only the first PAYLOAD_HEADER_SIZE bytes are read.
+    :param message_length: The full length of the message, if `message` only holds its start.
+    :return: A tuple containing the total segments count and the payload length in bytes.
+    :raises ValueError: If the message is not a valid payload message.
+    """
+    try:
+        magic_cookie, message_type, total_segments, _ = FULL_MESSAGES_STRUCTS[PAYLOAD_MESSAGE_TYPE].unpack_from(
+            message, 0
+        )
+    except struct.error as e:
+        raise ValueError(f"Failed to parse payload message: {e}")
+    if magic_cookie != MAGIC_COOKIE:
+        raise ValueError("Invalid magic cookie.")
+    if message_type != PAYLOAD_MESSAGE_TYPE:
+        raise ValueError(f"Got wrong message type, expected {PAYLOAD_MESSAGE_TYPE} and got {message_type}.")
+    if message_length is None:
+        message_length = len(message)
+    return total_segments, message_length - PAYLOAD_HEADER_SIZE
@@ -1,18 +1,43 @@
+import concurrent.futures
 import math
+import os
+import signal
 import socket
+import sys
+import tempfile
 import threading
 import time
-from typing import Tuple
-
-from hackathon.color_printing import print_in_color, COLORS, print_error
-from hackathon.protocol import BROADCAST_PORT, build_message, OFFER_MESSAGE_TYPE, PAYLOAD_MESSAGE_TYPE, \
-    parse_request_message, BUFFER_SIZE, TCP_MESSAGE_TERMINATOR
-
-DEFAULT_UDP_PAYLOAD_SIZE: int = 512  # Maximum size for UDP payloads
+import traceback
+from typing import BinaryIO, List, Tuple
+
+from hackathon.batch_io import BatchSender, SEND_BATCH_SIZE
+from hackathon.socket_buffers import set_send_buffer, set_tcp_send_buffer
+from hackathon.color_printing import print_in_color, COLORS, print_error, print_debug
+from hackathon.protocol import BROADCAST_PORT, build_message, build_message_into, OFFER_MESSAGE_TYPE, PAYLOAD_MESSAGE_TYPE, \
+    parse_request_message, BUFFER_SIZE, TCP_MESSAGE_TERMINATOR, END_MESSAGE_TYPE, PAYLOAD_HEADER_SIZE, \
+    SEGMENT_NUMBER_STRUCT, SEGMENT_NUMBER_OFFSET, REQUEST_MESSAGE_SIZE
+
+UDP_MTU: int = 1500  # Largest MTU the UDP payloads are sized for, raise to 9000 on jumbo-frame links
+IP_UDP_HEADERS_SIZE: int = 28  # IPv4 (20 bytes) + UDP (8 bytes) headers
+DEFAULT_UDP_PAYLOAD_SIZE: int = UDP_MTU - IP_UDP_HEADERS_SIZE - PAYLOAD_HEADER_SIZE  # Largest unfragmented payload
+IP_MTU: int = 14  # Linux socket option reporting a connected socket's path MTU, missing from the socket module
 BROADCAST_INTERVAL: int = 1  # Interval in seconds for broadcasting messages
 BROADCAST_ADDR: Tuple[str, int] = ("255.255.255.255", BROADCAST_PORT)  # Broadcast address and port
 UDP_SERVER_PORT: int = 8080
 TCP_SERVER_PORT: int = 8081
+TCP_HANDLER_THREADS: int = 64  # Bounds how many TCP clients are served at once by a process, the rest wait
+UDP_HANDLER_THREADS: int = 64  # Same for UDP clients, in a pool of its own so long TCP transfers don't delay them
+TCP_REQUEST_TIMEOUT: float = 5  # Seconds a TCP client has to send its request before its worker drops it
+SERVER_PROCESSES: int = os.cpu_count() or 1  # Processes sharing the server ports on Linux (SO_REUSEPORT), each with its own GIL
+UDP_SNDBUF: int = 12 * 1024 * 1024  # Kernel send buffer of the UDP socket all transfers share, so bursts don't block
+TCP_SNDBUF: int = 4 * 1024 * 1024  # Minimum send buffer for TCP responses (the link's BDP), left to autotuning if it reaches it
+TCP_REQUEST_SIZE: int = REQUEST_MESSAGE_SIZE + len(TCP_MESSAGE_TERMINATOR)  # TCP requests are read exactly this long
+TCP_MESSAGE_TERMINATOR_BYTE: int = TCP_MESSAGE_TERMINATOR[-1]  # Compared against the request's last byte as an int
+MAX_FILE_SIZE: int = 10 * 1024 ** 3  # Larger requests are rejected, so one client can't occupy a worker indefinitely
+END_MESSAGE_REPEATS: int = 3  # The end message is sent several times since any single datagram may be lost
+TCP_RESPONSE_CHUNK_SIZE: int = 1024 * 1024  # The TCP response is sent in slices of one shared chunk of this size
+TCP_RESPONSE_CHUNK: bytes = b"a" * TCP_RESPONSE_CHUNK_SIZE  # Built once, so requests allocate nothing per file size
+TCP_RESPONSE_FILE_SIZE: int = 16 * TCP_RESPONSE_CHUNK_SIZE  # Size of the file responses are sendfile'd from, per syscall
 
 def main() -> None:
     """
@@ -23,26 +48,109 @@ def main() -> None:
     ip_address = socket.gethostbyname(hostname)
     print_in_color(f"Server started, listening on IP address {ip_address}", color=COLORS.GREEN)
 
-    broadcast_thread = threading.Thread(
-        target=broadcast_offer_messages,
-        kwargs=dict(udp_port=UDP_SERVER_PORT, tcp_port=TCP_SERVER_PORT)
-    )
-    tcp_thread = threading.Thread(
-        target=start_tcp_server,
-        kwargs=dict(server_ip=ip_address, server_port=TCP_SERVER_PORT)
-    )
-    udp_thread = threading.Thread(
-        target=start_udp_server,
-        kwargs=dict(server_ip=ip_address, server_port=UDP_SERVER_PORT)
-    )
+    signal.signal(signal.SIGTERM, exit_on_signal)  # Unwinds like Ctrl+C does, so the cleanup below still runs
+
+    with open_tcp_response_file() as response_file:  # Created before forking, so all processes share its pages
+        worker_pids = []
+        try:
+            # On Linux the kernel balances SO_REUSEPORT ports between processes (other platforms pick one),
+            # so fork workers that serve alongside this one. Forking happens before any thread is started,
+            # and only this process broadcasts offers
+            if sys.platform.startswith("linux"):
+                # Sized once before forking, so a clamped buffer is warned about here instead of by every process
+                with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as probe_socket:
+                    set_send_buffer(probe_socket, UDP_SNDBUF)
+                for _ in range(SERVER_PROCESSES - 1):
+                    pid = os.fork()
+                    if pid == 0:
+                        run_server_process(ip_address, response_file)
+                    worker_pids.append(pid)
+
+            threading.Thread(  # Daemon, so stopping the servers below stops the whole server
+                target=broadcast_offer_messages,
+                kwargs=dict(udp_port=UDP_SERVER_PORT, tcp_port=TCP_SERVER_PORT),
+                daemon=True
+            ).start()
+            serve(ip_address, response_file)
+        finally:
+            stop_server_processes(worker_pids)
+
+
+def exit_on_signal(signum: int, frame) -> None:
+    """
+    A signal handler exiting by raising SystemExit, so finally blocks and context managers run on the way out.
+
+    :param signum: The received signal.
+    :param frame: The interrupted stack frame.
+    """
+    raise SystemExit(128 + signum)
+
+
+def run_server_process(ip_address: str, response_file: BinaryIO) -> None:
+    """
+    Runs `serve` in a forked server process and exits the process once it stops, never returning.
+
+    :param ip_address: The host address to bind the servers.
+    :param response_file: The file created by `open_tcp_response_file`.
+    """
+    exit_code = 0
+    try:
+        serve(ip_address, response_file)
+    except KeyboardInterrupt:
+        pass  # The parent reports the stop
+    except Exception:
+        print_error(f"Server process {os.getpid()} failed:")
+        traceback.print_exc()
+        exit_code = 1
+    finally:
+        sys.stdout.flush()  # os._exit skips flushing the buffered output
+        sys.stderr.flush()
+        os._exit(exit_code)
+
+
+def stop_server_processes(pids: List[int]) -> None:
+    """
+    Stops the forked server processes and waits for them to exit, so none is left serving the ports.
+
+    :param pids: The processes' ids.
+    """
+    for pid in pids:
+        try:
+            os.kill(pid, signal.SIGTERM)
+        except ProcessLookupError:
+            pass  # Already exited and reaped
+    for pid in pids:
+        try:
+            os.waitpid(pid, 0)
+        except ChildProcessError:
+            pass
 
-    tcp_thread.start()
-    udp_thread.start()
-    broadcast_thread.start()
 
-    tcp_thread.join()
-    udp_thread.join()
-    broadcast_thread.join()
+def serve(ip_address: str, response_file: BinaryIO) -> None:
+    """
+    Runs the TCP and UDP servers of one server process until the UDP server stops.
+
+    :param ip_address: The host address to bind the servers.
+    :param response_file: The file created by `open_tcp_response_file`.
+    """
+    # Client requests of each server are handled by a bounded pool, instead of a new thread per request
+    tcp_executor = concurrent.futures.ThreadPoolExecutor(max_workers=TCP_HANDLER_THREADS, thread_name_prefix="tcp")
+    udp_executor = concurrent.futures.ThreadPoolExecutor(max_workers=UDP_HANDLER_THREADS, thread_name_prefix="udp")
+
+    threading.Thread(  # Daemon, so stopping the UDP server below stops the process
+        target=start_tcp_server,
+        kwargs=dict(
+            server_ip=ip_address, server_port=TCP_SERVER_PORT, executor=tcp_executor, response_file=response_file
+        ),
+        daemon=True
+    ).start()
+
+    try:
+        # Served on the main thread instead of a thread of its own that would only be waited on
+        start_udp_server(server_ip=ip_address, server_port=UDP_SERVER_PORT, executor=udp_executor)
+    finally:
+        tcp_executor.shutdown(wait=False, cancel_futures=True)
+        udp_executor.shutdown(wait=False, cancel_futures=True)
 
 
 def broadcast_offer_messages(udp_port: int, tcp_port: int) -> None:
@@ -53,138 +161,265 @@ def broadcast_offer_messages(udp_port: int, tcp_port: int) -> None:
     :param tcp_port: The TCP port offered to clients.
     """
     offer_message = build_message(OFFER_MESSAGE_TYPE, udp_port, tcp_port)
-    while True:
-        send_broadcast_message(offer_message)
-        time.sleep(BROADCAST_INTERVAL)
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:  # One socket for every broadcast
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)  # level, opt, value
+        while True:
+            send_broadcast_message(sock, offer_message)
+            time.sleep(BROADCAST_INTERVAL)
 
 
-def send_broadcast_message(message: bytes) -> None:
+def send_broadcast_message(sock: socket.socket, message: bytes) -> None:
     """
     Sends a broadcast message.
 
+    :param sock: A UDP socket with SO_BROADCAST enabled.
     :param message: The message to be broadcasted.
     """
-    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
-        sock.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)  # level, opt, value
-        try:
-            sock.sendto(message, BROADCAST_ADDR)
-            print_in_color("DBG: Sent broadcast message...", color=COLORS.LIGHTYELLOW_EX)
-        except Exception as e:
-            print_error(f"Error sending broadcast message: {e}")
+    try:
+        sock.sendto(message, BROADCAST_ADDR)
+    except Exception as e:
+        print_error(f"Error sending broadcast message: {e}")
 
 
-def start_tcp_server(server_ip: str, server_port: int) -> None:
+def start_tcp_server(server_ip: str, server_port: int, executor: concurrent.futures.Executor,
+                     response_file: BinaryIO) -> None:
     """
     Starts a TCP server to handle client requests.
 
     :param server_ip: The host address to bind the server.
     :param server_port: The TCP port to listen on.
+    :param executor: The executor handling the client requests.
+    :param response_file: The file created by `open_tcp_response_file`.
     """
     with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as server_socket:
+        # Restarts can rebind right away, instead of failing while the last run's connections are in TIME_WAIT
+        server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        if hasattr(socket, "SO_REUSEPORT"):  # Lets every server process listen on the port
+            server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
         server_socket.bind((server_ip, server_port))
+        set_tcp_send_buffer(server_socket, TCP_SNDBUF)  # Inherited by the accepted sockets
         server_socket.listen(5)  # The max amount of clients that can wait for the server to accept the connection
-        print_in_color(f"DBG: Server listening on {server_ip}:{server_port}", color=COLORS.LIGHTYELLOW_EX)
+        print_debug("Server listening on %s:%d", server_ip, server_port)
 
         while True:
             try:
                 client_socket, client_address = server_socket.accept()
-                print_in_color(f"DBG: Connection from {client_address}", color=COLORS.LIGHTYELLOW_EX)
-                threading.Thread(
-                    target=handle_tcp_client_request,
-                    args=(client_socket,)
-                ).start()
+                print_debug("Connection from %s", client_address)
+                executor.submit(handle_tcp_client_request, client_socket, response_file)
             except Exception as e:
                 print_error(f"Error in TCP server: {e}")
 
 
-def handle_tcp_client_request(client_socket: socket.socket) -> None:
+def open_tcp_response_file() -> BinaryIO:
+    """
+    Creates the file TCP responses are sent from, filled with TCP_RESPONSE_FILE_SIZE bytes of 'a'.
+
+    :return: The open file, anonymous and in memory only on Linux.
+    """
+    if hasattr(os, "memfd_create"):
+        response_file = os.fdopen(os.memfd_create("tcp-response"), "w+b")
+    else:
+        response_file = tempfile.TemporaryFile()
+    for _ in range(TCP_RESPONSE_FILE_SIZE // TCP_RESPONSE_CHUNK_SIZE):
+        response_file.write(TCP_RESPONSE_CHUNK)
+    response_file.flush()
+    return response_file
+
+
+def handle_tcp_client_request(client_socket: socket.socket, response_file: BinaryIO) -> None:
     """
     Handles a single TCP client.
 
     :param client_socket: The client's socket.
+    :param response_file: The file created by `open_tcp_response_file`.
     """
     with client_socket:
         try:
-            message: bytes = client_socket.recv(BUFFER_SIZE)
-            if message[-1] != ord(TCP_MESSAGE_TERMINATOR):
+            client_socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)  # Don't hold back the response's tail
+            client_socket.settimeout(TCP_REQUEST_TIMEOUT)  # A client that never completes its request can't hold the worker
+            # TCP is a stream, so the request may arrive in pieces, read until it's complete
+            message = bytearray(TCP_REQUEST_SIZE)
+            message_view = memoryview(message)
+            received = 0
+            while received < TCP_REQUEST_SIZE:
+                received_now = client_socket.recv_into(message_view[received:])
+                if not received_now:
+                    raise ValueError(f"Connection closed after {received} bytes of the request.")
+                received += received_now
+            if message[-1] != TCP_MESSAGE_TERMINATOR_BYTE:
                 raise ValueError("Message is too large or improperly terminated with '\\n'.")
 
             file_size = parse_request_message(message)
-            print_in_color(f"DBG: Received filesize of {file_size} bytes", color=COLORS.LIGHTYELLOW_EX)
+            validate_file_size(file_size)
+            print_debug("Received filesize of %d bytes", file_size)
+            client_socket.settimeout(None)  # Back to blocking, which os.sendfile requires
 
-            response: bytes = b"a" * file_size
-            client_socket.sendall(response)
-            print_in_color(f"DBG: Sent response of length: {len(response)}", color=COLORS.LIGHTYELLOW_EX)
+            send_tcp_response(client_socket, file_size, response_file)
+            print_debug("Sent response of length: %d", file_size)
         except Exception as e:
             print_error(f"Error processing TCP client request: {e}")
 
 
-def start_udp_server(server_ip: str, server_port: int) -> None:
+def validate_file_size(file_size: int) -> None:
+    """
+    Checks that a requested file size is within what the server agrees to send.
+
+    :param file_size: The requested file size.
+    :raises ValueError: If the file size exceeds MAX_FILE_SIZE.
+    """
+    if file_size > MAX_FILE_SIZE:
+        raise ValueError(f"Requested file size {file_size} exceeds the maximum of {MAX_FILE_SIZE} bytes.")
+
+
+def send_tcp_response(client_socket: socket.socket, file_size: int, response_file: BinaryIO) -> None:
+    """
+    Sends a response of `file_size` bytes. Where os.sendfile exists the kernel sends them straight from
+    the response file's pages, with no copy through Python, otherwise slices of one shared chunk are sent.
+
+    :param client_socket: The client's socket.
+    :param file_size: The size of the response.
+    :param response_file: The file created by `open_tcp_response_file`.
+    """
+    if hasattr(os, "sendfile"):
+        sent = 0
+        while sent < file_size:
+            # Always from offset 0 with an explicit offset, so concurrent responses share the file without seeking it
+            sent += os.sendfile(
+                client_socket.fileno(), response_file.fileno(), 0, min(TCP_RESPONSE_FILE_SIZE, file_size - sent)
+            )
+        return
+
+    chunk_view = memoryview(TCP_RESPONSE_CHUNK)
+    for offset in range(0, file_size, TCP_RESPONSE_CHUNK_SIZE):
+        client_socket.sendall(chunk_view[:min(TCP_RESPONSE_CHUNK_SIZE, file_size - offset)])
+
+
+def start_udp_server(server_ip: str, server_port: int, executor: concurrent.futures.Executor) -> None:
     """
     Starts a UDP server to handle client requests.
 
     :param server_ip: The host address to bind the server.
     :param server_port: The UDP port to listen on.
+    :param executor: The executor handling the client requests.
     """
     with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as udp_socket:
+        udp_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)  # Restarts can rebind right away
+        if hasattr(socket, "SO_REUSEPORT"):  # Lets every server process bind the port, the kernel spreads clients
+            udp_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
         udp_socket.bind((server_ip, server_port))
-        print_in_color(f"DBG: UDP server listening on {server_ip}:{server_port}", color=COLORS.LIGHTYELLOW_EX)
-
+        set_send_buffer(udp_socket, UDP_SNDBUF)
+        if hasattr(socket, "IP_MTU_DISCOVER"):  # Never fragment, an oversized payload fails loudly instead
+            udp_socket.setsockopt(socket.IPPROTO_IP, socket.IP_MTU_DISCOVER, socket.IP_PMTUDISC_DO)
+        print_debug("UDP server listening on %s:%d", server_ip, server_port)
+
+        # Requests are parsed in place, so only the file size is handed to the handler and the buffer is reused
+        message_buffer = bytearray(BUFFER_SIZE)
+        message_view = memoryview(message_buffer)
         while True:
             try:
-                message, client_address = udp_socket.recvfrom(BUFFER_SIZE)
-                print_in_color(f"DBG: Received message from {client_address}: {message}", color=COLORS.LIGHTYELLOW_EX)
-
-                threading.Thread(
-                    target=handle_udp_client_request,
-                    args=(client_address, message)
-                ).start()
+                received, client_address = udp_socket.recvfrom_into(message_buffer)
+                try:
+                    file_size: int = parse_request_message(message_view[:received])
+                    validate_file_size(file_size)
+                except ValueError as e:
+                    print_error(f"Error processing UDP client {client_address}: {e}")
+                    continue
+                print_debug("Received a request for %d bytes from %s", file_size, client_address)
+
+                executor.submit(handle_udp_client_request, udp_socket, client_address, file_size)
             except Exception as e:
                 print_error(f"Error in UDP server: {e}")
 
 
-def handle_udp_client_request(client_address: Tuple[str, int], message: bytes) -> None:
+def handle_udp_client_request(udp_socket: socket.socket, client_address: Tuple[str, int], file_size: int) -> None:
     """
-    Handles a single UDP client in a separate thread.
+    Handles a single UDP client on an executor thread.
 
+    :param udp_socket: The server's UDP socket, the payloads are sent from it.
     :param client_address: The address of the client.
-    :param message: The message received from the client.
+    :param file_size: The file size the client requested.
     """
     try:
-        file_size: int = parse_request_message(message)
-        print_in_color(f"DBG: Handling UDP client {client_address}, received message: {message}", color=COLORS.LIGHTYELLOW_EX)
-        send_udp_file_segments(target_address=client_address, file_size=file_size, payload_size=DEFAULT_UDP_PAYLOAD_SIZE)
+        payload_size = get_udp_payload_size(client_address)
+        send_udp_file_segments(udp_socket=udp_socket, target_address=client_address, file_size=file_size, payload_size=payload_size)
     except Exception as e:
         print_error(f"Error processing UDP client {client_address}: {e}")
 
 
-def send_udp_file_segments(target_address: Tuple[str, int], file_size: int, payload_size: int) -> None:
+def get_udp_payload_size(target_address: Tuple[str, int]) -> int:
+    """
+    Sizes the UDP payloads for the path to a client, so that links with a smaller MTU than UDP_MTU
+    (PPPoE, VPNs) still get unfragmented datagrams instead of failing to send them.
+
+    :param target_address: The target client's address.
+    :return: The payload size, DEFAULT_UDP_PAYLOAD_SIZE at most, or exactly if the path MTU is unknown.
+    """
+    if not sys.platform.startswith("linux"):
+        return DEFAULT_UDP_PAYLOAD_SIZE
+    try:
+        with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as route_socket:
+            route_socket.connect(target_address)  # Only looks up the route, nothing is sent
+            path_mtu = route_socket.getsockopt(socket.IPPROTO_IP, IP_MTU)  # Includes MTUs learned from ICMP
+    except OSError:
+        return DEFAULT_UDP_PAYLOAD_SIZE
+    return min(DEFAULT_UDP_PAYLOAD_SIZE, path_mtu - IP_UDP_HEADERS_SIZE - PAYLOAD_HEADER_SIZE)
+
+
+def send_udp_file_segments(udp_socket: socket.socket, target_address: Tuple[str, int], file_size: int,
+                           payload_size: int) -> None:
     """
     Sends UDP payloads to a client.
 
+    :param udp_socket: The socket to send from, shared by concurrent transfers since sendto is thread-safe.
     :param target_address: The target client's address.
     :param file_size: The total size of the file.
     :param payload_size: The size of each UDP payload.
     """
-    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as udp_socket:
-        total_segments: int = math.ceil(file_size / payload_size)
-
-        for segment_number in range(total_segments):
-            bytes_sent = segment_number * payload_size
-            remaining_bytes = file_size - bytes_sent
-            current_payload_size = min(payload_size, remaining_bytes)
-            payload_data: bytes = b'a' * current_payload_size
-
-            payload_message: bytes = build_message(
-                PAYLOAD_MESSAGE_TYPE,
-                total_segments,
-                segment_number,
-                payload=payload_data
-            )
+    total_segments: int = math.ceil(file_size / payload_size)
+
+    # One header buffer per datagram in a batch, all gathered with a single shared payload buffer. The header,
+    # total segments and payload bytes never change, so they're written once and each segment only patches in
+    # its segment number
+    headers = [bytearray(PAYLOAD_HEADER_SIZE) for _ in range(SEND_BATCH_SIZE)]
+    for header in headers:
+        build_message_into(header, PAYLOAD_MESSAGE_TYPE, total_segments, 0)
+    payload = bytearray(b'a' * payload_size)
+    sender = BatchSender(udp_socket, target_address, [(header, payload) for header in headers])
+    pack_segment_number = SEGMENT_NUMBER_STRUCT.pack_into
 
-            udp_socket.sendto(payload_message, target_address)
-            print_in_color(f"DBG: Sent segment {segment_number + 1}/{total_segments}, size: {current_payload_size} bytes", color=COLORS.LIGHTYELLOW_EX)
+    last_payload_size = file_size - (total_segments - 1) * payload_size  # Only the last segment may be shorter
+    full_segments = total_segments if last_payload_size == payload_size else total_segments - 1
+
+    for batch_start in range(0, full_segments, SEND_BATCH_SIZE):
+        batch_size = min(SEND_BATCH_SIZE, full_segments - batch_start)
+        for index in range(batch_size):
+            pack_segment_number(headers[index], SEGMENT_NUMBER_OFFSET, batch_start + index)
+        sender.send(batch_size)
+
+    if full_segments < total_segments:
+        pack_segment_number(headers[0], SEGMENT_NUMBER_OFFSET, full_segments)
+        udp_socket.sendto(headers[0] + memoryview(payload)[:last_payload_size], target_address)
+
+    end_message: bytes = build_message(END_MESSAGE_TYPE, total_segments)
+    for _ in range(END_MESSAGE_REPEATS):
+        udp_socket.sendto(end_message, target_address)
+    print_debug("Sent %d segments to %s", total_segments, target_address)  # Once per transfer, not per segment
 
 
 if __name__ == '__main__':
-    main()
+    exit_code = 0
+    try:
+        main()
+    except KeyboardInterrupt:
+        print_in_color("Server stopped by user", color=COLORS.RED)
+    except SystemExit as e:  # E.g. SIGTERM, see `exit_on_signal`
+        exit_code = e.code if isinstance(e.code, int) else 1
+    except Exception:
+        traceback.print_exc()
+        exit_code = 1
+    finally:
+        # The handler pools' threads would be joined at exit, waiting out every in-flight transfer,
+        # so once main's cleanup has run the process exits right away and the transfers end with it
+        sys.stdout.flush()
+        sys.stderr.flush()
+        os._exit(exit_code)
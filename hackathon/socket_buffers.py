@@ -0,0 +1,93 @@
+import socket
+import sys
+from typing import Set
+
+from hackathon.color_printing import print_in_color, COLORS
+
+SO_SNDBUFFORCE: int = 32  # Linux only: like SO_SNDBUF but may exceed net.core.wmem_max, requires CAP_NET_ADMIN
+SO_RCVBUFFORCE: int = 33  # Linux only: like SO_RCVBUF but may exceed net.core.rmem_max, requires CAP_NET_ADMIN
+TCP_RMEM_PATH: str = "/proc/sys/net/ipv4/tcp_rmem"  # Linux: min, default and max of autotuned TCP receive buffers
+TCP_WMEM_PATH: str = "/proc/sys/net/ipv4/tcp_wmem"  # Linux: min, default and max of autotuned TCP send buffers
+_warned_limits: Set[str] = set()  # Sysctls already warned about, so each warning is printed once per process
+
+
+def set_receive_buffer(sock: socket.socket, size: int) -> None:
+    """
+    Requests a kernel receive buffer of the given size and warns if the kernel clamped it.
+    On Linux SO_RCVBUFFORCE is tried first, so privileged runs aren't capped by net.core.rmem_max.
+
+    :param sock: The socket to configure.
+    :param size: The requested receive buffer size in bytes.
+    """
+    _set_buffer(sock, size, socket.SO_RCVBUF, SO_RCVBUFFORCE, "net.core.rmem_max")
+
+
+def set_send_buffer(sock: socket.socket, size: int) -> None:
+    """
+    Requests a kernel send buffer of the given size and warns if the kernel clamped it.
+    On Linux SO_SNDBUFFORCE is tried first, so privileged runs aren't capped by net.core.wmem_max.
+
+    :param sock: The socket to configure.
+    :param size: The requested send buffer size in bytes.
+    """
+    _set_buffer(sock, size, socket.SO_SNDBUF, SO_SNDBUFFORCE, "net.core.wmem_max")
+
+
+def set_tcp_receive_buffer(sock: socket.socket, size: int) -> None:
+    """
+    Like `set_receive_buffer`, for TCP sockets. Setting the buffer turns off the kernel's receive autotuning
+    for the socket, so it is only set if autotuning can't grow the buffer to the given size on its own.
+
+    :param sock: The TCP socket to configure, before it connects.
+    :param size: The requested receive buffer size in bytes.
+    """
+    if size > _read_autotuning_max(TCP_RMEM_PATH):
+        set_receive_buffer(sock, size)
+
+
+def set_tcp_send_buffer(sock: socket.socket, size: int) -> None:
+    """
+    Like `set_send_buffer`, for TCP sockets. Setting the buffer turns off the kernel's send autotuning
+    for the socket, so it is only set if autotuning can't grow the buffer to the given size on its own.
+
+    :param sock: The TCP socket to configure, a listening socket's accepted sockets inherit the buffer.
+    :param size: The requested send buffer size in bytes.
+    """
+    if size > _read_autotuning_max(TCP_WMEM_PATH):
+        set_send_buffer(sock, size)
+
+
+def _read_autotuning_max(path: str) -> int:
+    """
+    :param path: The sysctl file listing the min, default and max autotuned buffer sizes.
+    :return: The largest size autotuning grows the buffer to, or 0 if the platform doesn't tell.
+    """
+    try:
+        with open(path) as sysctl_file:
+            return int(sysctl_file.read().split()[-1])
+    except (OSError, ValueError, IndexError):
+        return 0
+
+
+def _set_buffer(sock: socket.socket, size: int, option: int, force_option: int, limit_name: str) -> None:
+    """
+    :param sock: The socket to configure.
+    :param size: The requested buffer size in bytes.
+    :param option: The buffer's socket option (SO_RCVBUF or SO_SNDBUF).
+    :param force_option: The option's privileged variant that ignores the sysctl limit.
+    :param limit_name: The sysctl capping unprivileged requests, for the warning.
+    """
+    if sys.platform.startswith("linux"):
+        try:
+            sock.setsockopt(socket.SOL_SOCKET, force_option, size)
+        except PermissionError:  # Requires CAP_NET_ADMIN
+            sock.setsockopt(socket.SOL_SOCKET, option, size)
+    else:
+        sock.setsockopt(socket.SOL_SOCKET, option, size)
+    actual_size = sock.getsockopt(socket.SOL_SOCKET, option)  # Linux reports double the usable size
+    if actual_size < size and limit_name not in _warned_limits:
+        _warned_limits.add(limit_name)
+        print_in_color(
+            f"Requested a buffer of {size} bytes but got {actual_size} bytes (consider raising {limit_name})",
+            color=COLORS.YELLOW
+        )